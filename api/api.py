@@ -1,23 +1,36 @@
 import os
 import sys
+import shutil
 import numpy as np
-import io
+import struct
 import re
 import time
 import requests
 import platform
 import psutil
+import cpuinfo
 import asyncio
 import random
-from scipy.io.wavfile import write as write_wav
+import functools
+import hashlib
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field, model_validator
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.routing import APIRoute
+import orjson
+import onnxruntime as ort
 from kokoro_onnx import Kokoro, Tokenizer
+from kokoro_onnx.config import MAX_PHONEME_LENGTH
+from kokoro_onnx.session import resolve_providers
 from tqdm import tqdm
+from tqdm.utils import CallbackIOWrapper
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -34,47 +47,180 @@ VOICES_FILE = "voices-v1.0.bin"
 VOICES_URL = "https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/" + VOICES_FILE
 voices_path = os.path.join(MODELS_DIR, VOICES_FILE)
 
-MODEL_FILE = "kokoro-v1.0.int8.onnx"
+def detect_vnni() -> Optional[bool]:
+    """Checks for AVX512-VNNI or AVX-VNNI, which INT8 MatMul needs to be fast; None if the CPU flags cannot be read."""
+    try:
+        flags = set(cpuinfo.get_cpu_info().get("flags", []))
+    except Exception as e:
+        logger.warning(f"Could not read CPU flags: {str(e)}")
+        return None
+    if not flags:
+        return None
+    return "avx512_vnni" in flags or "avx_vnni" in flags
+
+def select_model_file() -> str:
+    # VNNI only matters on x86, where INT8 without it can be many times slower. FP32 is the fallback there,
+    # since FP16 on CPUs without FP16 arithmetic adds Cast nodes around every op.
+    if platform.machine().lower() not in ("x86_64", "amd64", "i386", "i686", "x86"):
+        logger.info(f"Non-x86 CPU ({platform.machine()}), using the INT8 model.")
+        return "kokoro-v1.0.int8.onnx"
+    has_vnni = detect_vnni()
+    if has_vnni is None:
+        logger.info("Could not detect VNNI support, keeping the INT8 model.")
+        return "kokoro-v1.0.int8.onnx"
+    if has_vnni:
+        logger.info("CPU supports VNNI, using the INT8 model.")
+        return "kokoro-v1.0.int8.onnx"
+    logger.info("CPU does not support VNNI, using the FP32 model.")
+    return "kokoro-v1.0.onnx"
+
+MODEL_FILE = select_model_file()
 model_path = os.path.join(MODELS_DIR, MODEL_FILE)
 
+DOWNLOAD_STREAMS = 8
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+def download_range(url: str, destination: str, bar: tqdm, start: Optional[int] = None, end: Optional[int] = None):
+    """Downloads url into destination, or only bytes start..end into the same offsets of a preallocated file.
+
+    Returns the number of bytes written.
+    """
+    headers = {"Range": f"bytes={start}-{end}"} if start is not None else {}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        if start is not None and r.status_code != 206:
+            raise RuntimeError(f"Server ignored range request for {os.path.basename(destination)}")
+        with open(destination, 'r+b' if start is not None else 'wb') as f:
+            if start is not None:
+                f.seek(start)
+            r.raw.decode_content = True
+            shutil.copyfileobj(r.raw, CallbackIOWrapper(bar.update, f, "write"), length=DOWNLOAD_CHUNK_SIZE)
+            return f.tell() - (start or 0)
+
 def download_file_robust(url: str, destination: str):
     logger.info(f"Downloading {os.path.basename(destination)}...")
     try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0))
-            with open(destination, 'wb') as f, tqdm(
-                total=total_size, unit='iB', unit_scale=True, desc=os.path.basename(destination)
-            ) as bar:
-                for chunk in r.iter_content(chunk_size=8192):
-                    size = f.write(chunk)
-                    bar.update(size)
-        if total_size != 0 and os.path.getsize(destination) != total_size:
-            logger.error(f"Download failed. File is incomplete: {destination}")
-            sys.exit(1)
-        logger.info("Download verified and complete.")
+        head = requests.head(url, allow_redirects=True, timeout=30)
+        head.raise_for_status()
+        # Range requests go straight to the final URL instead of following the redirect each time
+        url = head.url
+        total_size = int(head.headers.get('content-length', 0))
+        ranged = head.headers.get('accept-ranges') == 'bytes' and total_size > DOWNLOAD_CHUNK_SIZE
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"HEAD request failed ({e}), downloading with a single stream.")
+        total_size, ranged = 0, False
+    # Written under a temporary name, so an unfinished file never passes an os.path.exists check
+    part_path = destination + ".part"
+    try:
+        with tqdm(total=total_size or None, unit='iB', unit_scale=True, desc=os.path.basename(destination)) as bar:
+            if ranged:
+                with open(part_path, 'wb') as f:
+                    f.truncate(total_size)
+                part_size = -(-total_size // DOWNLOAD_STREAMS)
+                ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+                with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                    futures = [pool.submit(download_range, url, part_path, bar, start, end) for start, end in ranges]
+                    # The file is preallocated, so count the bytes each range wrote instead of trusting its size
+                    downloaded = sum(future.result() for future in futures)
+            else:
+                downloaded = download_range(url, part_path, bar)
+        if total_size != 0 and downloaded != total_size:
+            raise RuntimeError(f"Download failed. File is incomplete: {destination}")
+        os.replace(part_path, destination)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    logger.info("Download verified and complete.")
+
+# /benchmark and /set-model can request the same model at once; only one of them downloads it
+MODEL_DOWNLOAD_LOCKS = {m["filename"]: threading.Lock() for m in MODEL_FILES}
+
+def ensure_model_file(filename: str) -> str:
+    """Returns the local path of a model, downloading it first if it is missing."""
+    path = os.path.join(MODELS_DIR, filename)
+    with MODEL_DOWNLOAD_LOCKS[filename]:
+        if not os.path.exists(path):
+            model_info = next(m for m in MODEL_FILES if m["filename"] == filename)
+            download_file_robust(model_info["url"], path)
+    return path
+
+DOWNLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="download")
+
+def download_in_background(filename: str):
+    """Queues a model download; failures are only logged since no request waits on it."""
+    def log_failure(future):
+        if future.exception():
+            logger.error(f"Background download of {filename} failed: {future.exception()}")
+    DOWNLOAD_EXECUTOR.submit(ensure_model_file, filename).add_done_callback(log_failure)
+
+def download_models_if_missing():
+    # Only the selected model is fetched up front; the others are downloaded when benchmarked or selected
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    try:
+        ensure_model_file(MODEL_FILE)
+        if not os.path.exists(voices_path):
+            download_file_robust(VOICES_URL, voices_path)
     except Exception as e:
         logger.error(f"Failed to download model file. Error: {e}")
         sys.exit(1)
 
-def download_models_if_missing():
-    os.makedirs(MODELS_DIR, exist_ok=True)
-    for model_info in MODEL_FILES:
-        model_path = os.path.join(MODELS_DIR, model_info["filename"])
-        if not os.path.exists(model_path):
-            download_file_robust(model_info["url"], model_path)
-    if not os.path.exists(voices_path):
-        download_file_robust(VOICES_URL, voices_path)
+def create_session(path: str) -> ort.InferenceSession:
+    """Builds the ONNX Runtime session with one intra-op thread per physical core.
+
+    Set ORT_PROFILING=1 to write an ORT profile, e.g. to check whether FP16 Cast nodes dominate on this CPU.
+    """
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = psutil.cpu_count(logical=False) or 0
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.add_session_config_entry("session.disable_prepacking", "0")
+    sess_options.enable_profiling = os.environ.get("ORT_PROFILING") == "1"
+    # kokoro_onnx's provider choice honours ONNX_PROVIDER and uses GPU providers when an accelerated build is installed
+    return ort.InferenceSession(path, sess_options=sess_options, providers=resolve_providers())
+
+def load_kokoro(path: str) -> Kokoro:
+    return Kokoro.from_session(create_session(path), voices_path)
 
 download_models_if_missing()
 
 logger.info("Loading model and tokenizer...")
 tokenizer = Tokenizer()
-kokoro = Kokoro(model_path, voices_path)
+kokoro = load_kokoro(model_path)
+VOICES_SET = frozenset(kokoro.get_voices())  # Every model shares voices_path, so this survives /set-model
+VOICES_ETAG = '"' + hashlib.md5(",".join(sorted(VOICES_SET)).encode()).hexdigest() + '"'
+
+@functools.lru_cache(maxsize=4096)
+def phonemize_cached(text: str, lang: str) -> str:
+    return tokenizer.phonemize(text, lang=lang)
 SAMPLE_RATE = 24000
+# ORT already spreads one inference over every physical core, so concurrent requests queue here
+# instead of oversubscribing the CPU. On multi-socket hosts, set one worker per socket.
+INFER_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("INFER_WORKERS", "1")), thread_name_prefix="kokoro")
+STREAM_MAX_BATCH_SIZE = 4  # Sentences per batch when streaming; the first batch is a single sentence for time to first audio
 logger.info("Model and voices loaded successfully. API is ready.")
 
-app = FastAPI(title="Kokoro TTS Service", version="FINAL-STABLE")
+class ORJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+class ORJSONRoute(APIRoute):
+    """Decodes request bodies with orjson, which matters for scripts with hundreds of lines."""
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+        async def orjson_route_handler(request: Request):
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+        return orjson_route_handler
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_inference(warm_up)
+    yield
+
+app = FastAPI(title="Kokoro TTS Service", version="FINAL-STABLE", lifespan=lifespan)
+app.router.route_class = ORJSONRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -83,6 +229,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# PCM is not excluded like other audio/*; level 1 keeps compression cheap next to inference
+GZIP_COMPRESS_LEVEL = 1
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=GZIP_COMPRESS_LEVEL, exclude_content_types=("text/event-stream",))
 
 class VoiceComponent(BaseModel):
     voice: str
@@ -95,11 +244,11 @@ class DialogueLine(BaseModel):
     delay: Optional[float] = 0.0
     speed: float = Field(1.0, ge=0.25, le=2.0)
 
-    @model_validator(mode='before')
-    def check_voice_or_blend(cls, values):
-        if not (bool(values.get('voice')) ^ bool(values.get('blend_components'))):
+    @model_validator(mode='after')
+    def check_voice_or_blend(self):
+        if bool(self.voice) == bool(self.blend_components):
             raise ValueError('Each line must have "voice" or "blend_components", not both.')
-        return values
+        return self
 
 class SynthesizeRequest(BaseModel):
     script: List[DialogueLine]
@@ -118,6 +267,7 @@ class BenchmarkResponse(BaseModel):
     results: List[BenchmarkResult]
     system_info: dict
     recommendation: dict
+    downloading: List[str] = []  # Models skipped because they are still being downloaded
 
 class SetModelRequest(BaseModel):
     model_name: str
@@ -131,69 +281,208 @@ class RandomCustomVoiceRequest(BaseModel):
     speed: float = Field(1.0, ge=0.25, le=2.0)
     num_voices: int = Field(2, ge=2, le=3)
 
+BLEND_CACHE_SIZE = 16  # Each entry is a full ~0.5 MB style table, and random blends are never reused
+
+@functools.lru_cache(maxsize=BLEND_CACHE_SIZE)
+def blend_style(components: tuple):
+    """Returns the weighted average style of (voice, weight) pairs, or None if no voice is usable."""
+    components = [(voice, weight) for voice, weight in components if voice in VOICES_SET]
+    total_weight = sum(weight for _, weight in components)
+    if not components or total_weight <= 0:
+        return None
+    # Accumulate in place in FP32 rather than stacking every style into one large temporary
+    final_style = np.zeros(kokoro.get_voice_style(components[0][0]).shape, dtype=np.float32)
+    scratch = np.empty_like(final_style)
+    for voice, weight in components:
+        np.multiply(kokoro.get_voice_style(voice), weight / total_weight, out=scratch)
+        final_style += scratch
+    final_style.flags.writeable = False  # Shared between requests through the cache
+    return final_style
+
+def resolve_voice_or_style(line: DialogueLine):
+    """Returns the voice name or blended style array for a line, or None if it has no valid voice."""
+    if line.blend_components:
+        return blend_style(tuple(sorted((c.voice, c.weight) for c in line.blend_components)))
+    if line.voice and line.voice in VOICES_SET:
+        return line.voice
+    return None
+
+SENTENCE_RE = re.compile(r'[^.?!]+[.?!]+|[^.?!]+$')
+
+def split_sentences(text: str) -> List[str]:
+    sentences = (m.group(0).strip() for m in SENTENCE_RE.finditer(text))
+    return [s for s in sentences if s]
+
+def plan_batches(script: List[DialogueLine], by_sentence: bool = False, max_batch_size: Optional[int] = None,
+                 first_batch_size: Optional[int] = None):
+    """Groups consecutive lines (or sentences) sharing a voice and speed into batches.
+
+    Yields an int sample count for each delay, and a (voice_or_style, speed, phonemes_list)
+    tuple for each batch. A delay always closes the current batch so the silence stays in place.
+    first_batch_size, if set, caps the first batch separately so streaming can start sooner.
+    """
+    batch, batch_key, batch_voice, batch_speed, batch_len = [], None, None, None, 0
+    batch_cap = first_batch_size or max_batch_size
+    for line_no, line in enumerate(script, 1):
+        voice_or_style = resolve_voice_or_style(line)
+        if voice_or_style is None:
+            logger.warning(f"Skipping line {line_no}: No valid voice or blend components")
+            continue
+        if line.delay and line.delay > 0:
+            if batch:
+                yield batch_voice, batch_speed, batch
+                batch, batch_len, batch_cap = [], 0, max_batch_size
+            yield int(line.delay * SAMPLE_RATE)
+        key = (line.voice or tuple((c.voice, c.weight) for c in line.blend_components), line.speed)
+        for text in (split_sentences(line.text) if by_sentence else [line.text]):
+            phonemes = phonemize_cached(text, "en-us")
+            if not phonemes:
+                logger.warning(f"Skipping line {line_no}: No phonemes generated")
+                continue
+            if batch and (key != batch_key
+                          or batch_len + len(phonemes) + 1 > MAX_PHONEME_LENGTH
+                          or (batch_cap and len(batch) >= batch_cap)):
+                yield batch_voice, batch_speed, batch
+                batch, batch_len, batch_cap = [], 0, max_batch_size
+            if not batch:
+                batch_key, batch_voice, batch_speed = key, voice_or_style, line.speed
+            batch.append(phonemes)
+            batch_len += len(phonemes) + 1
+    if batch:
+        yield batch_voice, batch_speed, batch
+
+def batch_create(model: Kokoro, phonemes_list: List[str], voice, speed: float):
+    """Synthesizes a batch of phoneme strings with a single model.create call.
+
+    The exported graph only takes a batch of one, so the batch is joined into one
+    sequence; plan_batches keeps it under MAX_PHONEME_LENGTH so it stays one session run.
+    The model is bound when the job is queued, so a /set-model reload never leaves it unbound.
+    """
+    samples, _ = model.create(" ".join(phonemes_list), voice=voice, speed=speed, is_phonemes=True)
+    return samples
+
+def pcm16_bytes(samples: np.ndarray) -> bytes:
+    """Converts float audio in [-1, 1] to little-endian 16-bit PCM."""
+    # One float32 temporary, clipped in place, whatever dtype the model returned
+    scaled = np.multiply(samples, 32767.0, dtype=np.float32)
+    np.clip(scaled, -32767.0, 32767.0, out=scaled)
+    return scaled.astype('<i2').tobytes()
+
+SILENCE_BLOCK = bytes(SAMPLE_RATE * 2)  # One second of 16-bit PCM silence, shared by every delay
+
+def silence_chunks(num_samples: int):
+    """Yields num_samples of 16-bit PCM silence as whole shared blocks plus a view of one remainder."""
+    whole_blocks, remainder = divmod(num_samples * 2, len(SILENCE_BLOCK))
+    for _ in range(whole_blocks):
+        yield SILENCE_BLOCK
+    if remainder:
+        yield memoryview(SILENCE_BLOCK)[:remainder]  # A view, so even the remainder allocates no new buffer
+
+def wav_header(data_size: Optional[int], sample_rate: int) -> bytes:
+    """Packs a canonical 44-byte header for mono 16-bit PCM; a None size marks a stream of unknown length."""
+    riff_size = 0xFFFFFFFF if data_size is None else 36 + data_size
+    data_size = 0xFFFFFFFF if data_size is None else data_size
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', riff_size, b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', data_size,
+    )
+
+def wav_bytes(audio: np.ndarray, sample_rate: int, normalize: bool = False) -> bytes:
+    """Encodes float audio as a mono 16-bit PCM WAV file.
+
+    With normalize the peak is scaled to full range as part of the int16 conversion, in one pass.
+    """
+    if normalize:
+        # Two reductions, no np.abs temporary
+        max_val = max(float(audio.max()), -float(audio.min())) if audio.size else 0.0
+        scale = 32767.0 / max_val if max_val > 0 else 0.0
+        pcm = np.multiply(audio, scale, dtype=np.float32).astype('<i2', copy=False).tobytes()
+    else:
+        pcm = pcm16_bytes(audio)
+    return wav_header(len(pcm), sample_rate) + pcm
+
+async def run_inference(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(INFER_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+def timed_create(model: Kokoro, *args, **kwargs):
+    """Runs model.create and returns (samples, sample_rate, seconds), timed inside the worker so queueing is excluded."""
+    start_time = time.perf_counter()
+    samples, sample_rate = model.create(*args, **kwargs)
+    return samples, sample_rate, time.perf_counter() - start_time
+
 async def generate_full_audio(script: List[DialogueLine]):
     logger.info(f"Generating audio for script with {len(script)} lines")
     start_time = time.time()
-    all_samples = []
-    chunk_size = 10  # Process 10 lines at a time
-    for chunk_idx, i in enumerate(range(0, len(script), chunk_size)):
-        chunk = script[i:i + chunk_size]
-        logger.debug(f"Processing chunk {chunk_idx + 1} ({len(chunk)} lines)")
-        chunk_samples = []
-        for idx, line in enumerate(chunk):
-            logger.debug(f"Processing line {i + idx + 1}: {line.text[:50]}...")
-            voice_or_style = None
-            if line.blend_components:
-                final_style = np.zeros(256, dtype=np.float16)
-                total_weight = sum(c.weight for c in line.blend_components)
-                for c in line.blend_components:
-                    if c.voice in kokoro.get_voices():
-                        final_style = np.add(final_style, kokoro.get_voice_style(c.voice) * c.weight)
-                if total_weight > 0:
-                    final_style /= total_weight
-                voice_or_style = final_style
-            elif line.voice and line.voice in kokoro.get_voices():
-                voice_or_style = line.voice
-            if voice_or_style is None:
-                logger.warning(f"Skipping line {i + idx + 1}: No valid voice or blend components")
-                continue
-            if line.delay and line.delay > 0:
-                chunk_samples.append(np.zeros(int(line.delay * SAMPLE_RATE), dtype=np.float32))
-            phonemes = tokenizer.phonemize(line.text, lang="en-us")
-            if not phonemes:
-                logger.warning(f"Skipping line {i + idx + 1}: No phonemes generated")
-                continue
-            line_start = time.time()
-            samples, _ = await asyncio.to_thread(kokoro.create, phonemes, voice=voice_or_style, speed=line.speed, is_phonemes=True)
-            logger.debug(f"Line {i + idx + 1} synthesis took {time.time() - line_start:.2f} seconds")
-            chunk_samples.append(samples.astype(np.float32))
-        if chunk_samples:
-            all_samples.append(np.concatenate(chunk_samples))
-        logger.debug(f"Chunk {chunk_idx + 1} completed in {time.time() - start_time:.2f} seconds")
-    full_audio = np.concatenate(all_samples) if all_samples else np.array([], dtype=np.float32)
+    # Segments are sample arrays, or ints for delays so silence is never materialized
+    segments = []
+    total_len = 0
+    for batch_idx, item in enumerate(plan_batches(script)):
+        if isinstance(item, int):
+            segments.append(item)
+            total_len += item
+            continue
+        voice_or_style, speed, phonemes_list = item
+        batch_start = time.time()
+        samples = await run_inference(batch_create, kokoro, phonemes_list, voice_or_style, speed)
+        logger.debug(f"Batch {batch_idx + 1} ({len(phonemes_list)} lines) synthesis took {time.time() - batch_start:.2f} seconds")
+        segments.append(samples)
+        total_len += len(samples)
+    full_audio = np.empty(total_len, dtype=np.float32)
+    offset = 0
+    for segment in segments:
+        if isinstance(segment, int):
+            full_audio[offset:offset + segment] = 0.0
+            offset += segment
+        else:
+            full_audio[offset:offset + len(segment)] = segment
+            offset += len(segment)
     logger.info(f"Total audio generation took {time.time() - start_time:.2f} seconds")
     return full_audio
 
+def warm_up():
+    """Runs a tiny inference with a plain voice and a blended style so the first request skips ORT's cold start."""
+    voices = sorted(VOICES_SET)
+    if not voices:
+        return
+    voice = "af_sky" if "af_sky" in VOICES_SET else voices[0]
+    phonemes = phonemize_cached("hello", "en-us")
+    start_time = time.time()
+    try:
+        kokoro.create(phonemes, voice=voice, is_phonemes=True)
+        kokoro.create(phonemes, voice=blend_style(tuple(sorted({(voice, 0.5), (voices[-1], 0.5)}))), is_phonemes=True)
+        logger.info(f"Model warm-up took {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.warning(f"Model warm-up failed: {str(e)}")
+
 @app.get("/benchmark", response_model=BenchmarkResponse)
-async def benchmark_models():
+async def benchmark_models(response: Response):
     logger.info("Running benchmark...")
     start_time = time.time()
     benchmark_text = "This is a standard sentence for benchmarking."
-    phonemes = tokenizer.phonemize(benchmark_text, lang="en-us")
+    phonemes = phonemize_cached(benchmark_text, "en-us")
     results = []
+    downloading = []
     process = psutil.Process()
     mem_before_all = process.memory_info().rss / (1024 * 1024)
     model_timeout = 30
 
     for model_info in MODEL_FILES:
         filename = model_info["filename"]
-        model_path = os.path.join(MODELS_DIR, filename)
-        file_size_mb = os.path.getsize(model_path) / (1024 * 1024)
-
         logger.debug(f"Benchmarking model: {filename}")
         try:
+            model_path = os.path.join(MODELS_DIR, filename)
+            # Downloading a missing model here would outlast any client timeout, so it is fetched in the background
+            if not os.path.exists(model_path):
+                logger.info(f"Model {filename} is not downloaded yet, downloading it in the background")
+                download_in_background(filename)
+                downloading.append(filename)
+                continue
+            file_size_mb = os.path.getsize(model_path) / (1024 * 1024)
             start_load_time = time.perf_counter()
-            kokoro_instance = Kokoro(model_path, voices_path)
+            kokoro_instance = load_kokoro(model_path)
             end_load_time = time.perf_counter()
             load_time = end_load_time - start_load_time
             if load_time > model_timeout:
@@ -202,10 +491,7 @@ async def benchmark_models():
 
             mem_after_load = process.memory_info().rss / (1024 * 1024)
 
-            start_infer_time = time.perf_counter()
-            samples, sample_rate = kokoro_instance.create(phonemes, voice="am_adam", is_phonemes=True)
-            end_infer_time = time.perf_counter()
-            inference_time = end_infer_time - start_infer_time
+            samples, sample_rate, inference_time = await run_inference(timed_create, kokoro_instance, phonemes, voice="am_adam", is_phonemes=True)
             if inference_time > model_timeout:
                 logger.warning(f"Model {filename} inference time exceeded {model_timeout}s, skipping")
                 del kokoro_instance
@@ -233,6 +519,9 @@ async def benchmark_models():
             logger.error(f"Failed to benchmark model {filename}: {str(e)}")
             continue
 
+    if downloading:
+        # Results are partial until the downloads finish, so clients must not cache them
+        response.headers["Cache-Control"] = "no-store"
     if not results:
         logger.error("No models successfully benchmarked")
         raise HTTPException(status_code=500, detail="No models could be benchmarked due to timeouts or errors")
@@ -267,7 +556,7 @@ async def benchmark_models():
     }
 
     logger.info(f"Benchmark completed in {time.time() - start_time:.2f} seconds")
-    return {"results": results, "system_info": system_info, "recommendation": recommendation}
+    return {"results": results, "system_info": system_info, "recommendation": recommendation, "downloading": downloading}
 
 @app.post("/set-model")
 async def set_model(request: SetModelRequest):
@@ -276,13 +565,17 @@ async def set_model(request: SetModelRequest):
     if requested_model not in [m["filename"] for m in MODEL_FILES]:
         raise HTTPException(status_code=400, detail=f"Invalid model: {requested_model}. Available models: {[m['filename'] for m in MODEL_FILES]}")
     new_model_path = os.path.join(MODELS_DIR, requested_model)
+    # Downloading inside the request would outlast the client timeout, so it is fetched in the background
     if not os.path.exists(new_model_path):
-        raise HTTPException(status_code=400, detail=f"Model file {requested_model} not found.")
+        logger.info(f"Model {requested_model} is not downloaded yet, downloading it in the background")
+        download_in_background(requested_model)
+        raise HTTPException(status_code=503, detail=f"Model {requested_model} is still downloading. Try again in a few minutes.", headers={"Retry-After": "60"})
     try:
         logger.info(f"Switching to model: {requested_model}")
         model_path = new_model_path
-        del kokoro
-        kokoro = Kokoro(model_path, voices_path)
+        # Rebinding rather than deleting first keeps the name valid for requests queued during the load
+        kokoro = load_kokoro(model_path)
+        await run_inference(warm_up)
         return {"status": f"Successfully switched to model {requested_model}"}
     except Exception as e:
         logger.error(f"Failed to switch model: {str(e)}")
@@ -296,18 +589,12 @@ async def random_speaker(request: RandomSpeakerRequest):
             raise HTTPException(status_code=400, detail="No voices available.")
         random_voice = random.choice(voices)
         logger.info(f"Selected random voice: {random_voice}")
-        script = [{"text": request.text, "voice": random_voice, "speed": request.speed}]
+        script = [DialogueLine(text=request.text, voice=random_voice, speed=request.speed)]
         full_audio = await generate_full_audio(script)
         if full_audio.size == 0:
             return Response(content=b"", media_type="audio/wav")
-        max_val = np.max(np.abs(full_audio))
-        if max_val > 0:
-            full_audio /= max_val
-        buffer = io.BytesIO()
-        write_wav(buffer, SAMPLE_RATE, full_audio)
-        buffer.seek(0)
         return Response(
-            content=buffer.getvalue(),
+            content=wav_bytes(full_audio, SAMPLE_RATE, normalize=True),
             media_type="audio/wav",
             headers={"X-Selected-Voice": random_voice}
         )
@@ -325,20 +612,14 @@ async def random_custom_voice(request: RandomCustomVoiceRequest):
         weights = np.random.dirichlet(np.ones(request.num_voices))
         blend_components = [{"voice": voice, "weight": float(weight)} for voice, weight in zip(selected_voices, weights)]
         logger.info(f"Blended voices: {blend_components}")
-        script = [{"text": request.text, "blend_components": blend_components, "speed": request.speed}]
+        script = [DialogueLine(text=request.text, blend_components=blend_components, speed=request.speed)]
         full_audio = await generate_full_audio(script)
         if full_audio.size == 0:
             return Response(content=b"", media_type="audio/wav")
-        max_val = np.max(np.abs(full_audio))
-        if max_val > 0:
-            full_audio /= max_val
-        buffer = io.BytesIO()
-        write_wav(buffer, SAMPLE_RATE, full_audio)
-        buffer.seek(0)
         return Response(
-            content=buffer.getvalue(),
+            content=wav_bytes(full_audio, SAMPLE_RATE, normalize=True),
             media_type="audio/wav",
-            headers={"X-Blended-Voices": json.dumps(blend_components)}
+            headers={"X-Blended-Voices": orjson.dumps(blend_components).decode()}
         )
     except Exception as e:
         logger.error(f"Random custom voice error: {str(e)}")
@@ -349,70 +630,73 @@ def read_root():
     return {"status": "Kokoro TTS API is running."}
 
 @app.get("/voices", response_model=List[str])
-async def get_voices():
-    return sorted(kokoro.get_voices())
+async def get_voices(request: Request):
+    if request.headers.get("if-none-match") == VOICES_ETAG:
+        return Response(status_code=304, headers={"ETag": VOICES_ETAG})
+    return Response(content=orjson.dumps(sorted(VOICES_SET)), media_type="application/json", headers={"ETag": VOICES_ETAG})
 
-@app.post("/synthesize-stream")
-async def synthesize_stream(request: SynthesizeRequest):
+async def stream_pcm(script: List[DialogueLine]):
+    """Yields 16-bit PCM for each batch as soon as it is synthesized, with the producer running ahead."""
     q = asyncio.Queue(maxsize=20)
     async def producer():
-        chunk_size = 10
-        for chunk_idx, i in enumerate(range(0, len(request.script), chunk_size)):
-            chunk = request.script[i:i + chunk_size]
-            logger.debug(f"Streaming chunk {chunk_idx + 1} ({len(chunk)} lines)")
-            for line in chunk:
-                voice_or_style = None
-                if line.blend_components:
-                    final_style = np.zeros(256, dtype=np.float16)
-                    total_weight = sum(c.weight for c in line.blend_components)
-                    for c in line.blend_components:
-                        if c.voice in kokoro.get_voices():
-                            final_style = np.add(final_style, kokoro.get_voice_style(c.voice) * c.weight)
-                    if total_weight > 0:
-                        final_style /= total_weight
-                    voice_or_style = final_style
-                elif line.voice and line.voice in kokoro.get_voices():
-                    voice_or_style = line.voice
-                if voice_or_style is None:
+        # Cancellation is left to propagate, so an aborted stream stops before its next batch
+        try:
+            for item in plan_batches(script, by_sentence=True, max_batch_size=STREAM_MAX_BATCH_SIZE, first_batch_size=1):
+                if isinstance(item, int):
+                    await q.put(item)
                     continue
-                if line.delay and line.delay > 0:
-                    await q.put(np.zeros(int(line.delay * SAMPLE_RATE), dtype=np.float32))
-                sentences = re.split(r'(?<=[.?!])\s*', line.text)
-                sentences = [s.strip() for s in sentences if s.strip()]
-                for sentence in sentences:
-                    phonemes = tokenizer.phonemize(sentence, lang="en-us")
-                    if not phonemes:
-                        continue
-                    samples, _ = await asyncio.to_thread(kokoro.create, phonemes, voice=voice_or_style, speed=line.speed, is_phonemes=True)
-                    await q.put(samples)
-            logger.debug(f"Chunk {chunk_idx + 1} streamed")
+                voice_or_style, speed, phonemes_list = item
+                samples = await run_inference(batch_create, kokoro, phonemes_list, voice_or_style, speed)
+                await q.put(samples)
+        except Exception as e:
+            logger.error(f"Streaming error: {str(e)}")
+            # Handed to the consumer, which re-raises it so the chunked body is aborted instead of ending cleanly
+            await q.put(e)
+            return
         await q.put(None)
-    async def stream_generator():
-        asyncio.create_task(producer())
+    producer_task = asyncio.create_task(producer())
+    try:
         while True:
             samples = await q.get()
             if samples is None:
                 break
-            yield samples.astype(np.float32).tobytes()
-    headers = {"X-Sample-Rate": str(SAMPLE_RATE)}
-    return StreamingResponse(stream_generator(), media_type="application/octet-stream", headers=headers)
+            if isinstance(samples, Exception):
+                raise samples
+            if isinstance(samples, int):
+                for block in silence_chunks(samples):
+                    yield block
+            else:
+                yield pcm16_bytes(samples)
+    finally:
+        # Runs when the client disconnects too, so the producer never blocks on a full queue forever
+        producer_task.cancel()
+        await asyncio.gather(producer_task, return_exceptions=True)
+
+async def stream_wav(script: List[DialogueLine]):
+    yield wav_header(None, SAMPLE_RATE)
+    async for pcm in stream_pcm(script):
+        yield pcm
+
+@app.post("/synthesize-stream")
+async def synthesize_stream(request: SynthesizeRequest):
+    headers = {"X-Sample-Rate": str(SAMPLE_RATE), "X-Sample-Format": "int16"}
+    return StreamingResponse(stream_pcm(request.script), media_type="application/octet-stream", headers=headers)
 
 @app.post("/synthesize-wav")
-async def synthesize_wav(request: SynthesizeRequest):
+async def synthesize_wav(request: SynthesizeRequest, stream: bool = False):
+    # Streaming sends each batch as it is ready instead of holding the whole file in memory,
+    # at the cost of clipping to the model's [-1, 1] range rather than peak-normalizing
+    if stream:
+        logger.info(f"Received streaming synthesis request with {len(request.script)} lines")
+        return StreamingResponse(stream_wav(request.script), media_type="audio/wav")
     try:
         logger.info(f"Received synthesis request with {len(request.script)} lines")
         full_audio = await generate_full_audio(request.script)
         if full_audio.size == 0:
             logger.warning("No audio generated")
             return Response(content=b"", media_type="audio/wav")
-        max_val = np.max(np.abs(full_audio))
-        if max_val > 0:
-            full_audio /= max_val
-        buffer = io.BytesIO()
-        write_wav(buffer, SAMPLE_RATE, full_audio)
-        buffer.seek(0)
         logger.info("Synthesis completed successfully")
-        return Response(content=buffer.getvalue(), media_type="audio/wav")
+        return Response(content=wav_bytes(full_audio, SAMPLE_RATE, normalize=True), media_type="audio/wav")
     except Exception as e:
         logger.error(f"Synthesis error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
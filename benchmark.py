@@ -29,7 +29,7 @@ def download_file_if_missing(filename, url):
             with requests.get(url, stream=True) as r:
                 r.raise_for_status();
                 with open(file_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192): f.write(chunk)
+                    for chunk in r.iter_content(chunk_size=1 << 20): f.write(chunk)
             print("Download complete.")
         except Exception as e: print(f"FATAL ERROR: Failed to download '{filename}'. Error: {e}"); sys.exit(1)
     return file_path
@@ -43,7 +43,7 @@ def print_recommendations(results):
     int8_model = next((r for r in results if 'int8' in r['name']), None)
     if int8_model and int8_model['rtf'] > fastest_inference['rtf']: print(f"      NOTE: The int8 model was surprisingly slower (RTF: {int8_model['rtf']:.2f}) in this test.")
     if highest_quality: print(f"\n FOR HIGHEST AUDIO QUALITY (Offline Tasks):"); print(f"   -> {highest_quality['name']}"); print(f"      Reason: Highest fidelity, but uses the most memory ({highest_quality['mem_usage']:.0f} MB).")
-    print("\n" + "="*70); print("\n ACTION: To use the recommended model for your API, update the 'MODEL_FILE' variable"); print(f"          in your 'api/api.py' script to '{best_balanced['name']}'.")
+    print("\n" + "="*70); print("\n ACTION: The API picks INT8 or FP32 at startup from the CPU's VNNI support. To use the recommended model"); print(f"          instead, POST {{\"model_name\": \"{best_balanced['name']}\"}} to the API's /set-model endpoint.")
 
 def print_system_info():
     print("\n\n" + "="*70); print("--- System Information ---"); print("="*70)
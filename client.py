@@ -4,11 +4,15 @@ import numpy as np
 import argparse
 import sys
 import json
+import queue
+import threading
 from scipy.io.wavfile import write as write_wav
+from kokoro_client import error_detail, raise_for_status_streamed
 import time
 
 API_BASE_URL = "http://localhost:8111"
 SAMPLE_RATE = 24000  # Matches API's default sample rate
+STREAM_BUFFER_MS = 200  # Audio buffered before playback starts, absorbs network jitter
 
 def get_available_voices():
     try:
@@ -31,6 +35,54 @@ def get_current_model():
         print(f"Error fetching current model: {e}")
         return "Unknown"
 
+def play_pcm_stream(response, sample_rate, dtype):
+    """Plays a raw PCM response through a callback stream, so playback is decoupled from network timing."""
+    chunks = queue.Queue()
+    current = np.zeros(0, dtype=dtype)
+    finished = threading.Event()
+
+    def callback(outdata, frames, time_info, status):
+        nonlocal current
+        filled = 0
+        while filled < frames:
+            if not len(current):
+                try:
+                    current = chunks.get_nowait()
+                except queue.Empty:
+                    break  # Underrun: pad with silence and wait for the network
+                if current is None:
+                    outdata[filled:] = 0
+                    raise sd.CallbackStop
+            n = min(frames - filled, len(current))
+            outdata[filled:filled + n, 0] = current[:n]
+            current = current[n:]
+            filled += n
+        outdata[filled:] = 0
+
+    stream = sd.OutputStream(samplerate=sample_rate, channels=1, dtype=dtype.name,
+                             callback=callback, finished_callback=finished.set)
+    prebuffer = sample_rate * STREAM_BUFFER_MS // 1000
+    buffered = 0
+    buffer = bytearray()
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            buffer.extend(chunk)
+            # Keep a trailing partial sample in the buffer for the next chunk
+            usable = len(buffer) - len(buffer) % dtype.itemsize
+            if usable:
+                # One copy out of the buffer; the temporary view is released before the buffer is trimmed
+                chunks.put(np.frombuffer(buffer, dtype=dtype, count=usable // dtype.itemsize).copy())
+                del buffer[:usable]
+                buffered += usable // dtype.itemsize
+            if not stream.active and buffered >= prebuffer:
+                stream.start()
+        chunks.put(None)
+        if not stream.active:
+            stream.start()
+        finished.wait()
+    finally:
+        stream.close()
+
 def handle_synthesis_request(dialogue_script: list, output_file: str = None):
     if not dialogue_script:
         print("Error: Script is empty.")
@@ -47,7 +99,7 @@ def handle_synthesis_request(dialogue_script: list, output_file: str = None):
             print(f"Using WAV endpoint: {endpoint_url}")
             start_time = time.time()
             with requests.post(endpoint_url, json=payload, timeout=600) as response:
-                response.raise_for_status()
+                raise_for_status_streamed(response)
                 with open(output_file, 'wb') as f:
                     f.write(response.content)
                 elapsed_time = time.time() - start_time
@@ -56,32 +108,21 @@ def handle_synthesis_request(dialogue_script: list, output_file: str = None):
             endpoint_url = f"{API_BASE_URL}/synthesize-stream"
             print(f"Using Streaming endpoint: {endpoint_url}")
             print("Playing audio stream...")
-            buffer = bytearray()
             with requests.post(endpoint_url, json=payload, stream=True, timeout=600) as response:
-                response.raise_for_status()
+                raise_for_status_streamed(response)
                 sample_rate = int(response.headers.get("X-Sample-Rate", SAMPLE_RATE))
-                with sd.OutputStream(samplerate=sample_rate, channels=1, dtype='float32') as stream:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            buffer.extend(chunk)
-                            # Ensure buffer is a multiple of 4 bytes (float32)
-                            remainder = len(buffer) % 4
-                            if remainder == 0:
-                                audio_data = np.frombuffer(buffer, dtype=np.float32)
-                                if audio_data.size > 0:
-                                    stream.write(audio_data)
-                                buffer = bytearray()  # Clear buffer after writing
-                            # Keep incomplete chunks in buffer for next iteration
+                # Older servers stream float32 and do not send the header
+                sample_format = response.headers.get("X-Sample-Format", "float32")
+                play_pcm_stream(response, sample_rate, np.dtype(np.int16 if sample_format == "int16" else np.float32))
             print("Playback finished.")
 
     except requests.exceptions.Timeout:
         print(f"Error: Request timed out after 600 seconds. Try splitting the script or using a faster model (e.g., INT8).")
     except requests.exceptions.RequestException as e:
         print(f"Error: API request failed: {e}")
-        try:
-            print(f"Server response: {response.json()}")
-        except:
-            pass
+        detail = error_detail(e)
+        if detail is not None:
+            print(f"Server response: {detail}")
     except Exception as e:
         print(f"Error during audio processing: {e}")
 
@@ -1,97 +1,121 @@
 import gradio as gr
 import requests
-import numpy as np
-import io
-import json
+import orjson
 import time
+import functools
 import os
-from scipy.io.wavfile import read as read_wav
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from kokoro_client import KokoroClient, error_detail, BENCHMARK_CACHE_TTL
 
 API_BASE_URL = os.environ.get("API_URL", "http://localhost:8000")
 VOICE_CHOICES = []
+CLIENT = KokoroClient(API_BASE_URL)
+EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="synthesis")
+STATUS_INTERVAL = 1.0  # Seconds between status updates while waiting on the API
+EXAMPLE_SCRIPT = {"script": [{"text": "This is an editable script.", "voice": "am_eric", "speed": 0.9}, {"text": "Each line has its own timing and voice.", "voice": "af_sky", "delay": 0.5}]}
+EXAMPLE_SCRIPT_STR = orjson.dumps(EXAMPLE_SCRIPT, option=orjson.OPT_INDENT_2).decode()
 FALLBACK_MODELS = [
     "kokoro-v1.0.onnx",
     "kokoro-v1.0.fp16.onnx",
     "kokoro-v1.0.int8.onnx"
 ]
 
-def fetch_voices_with_retry(max_retries=10, delay_seconds=5):
+@functools.lru_cache(maxsize=1)
+def fetch_voices_cached():
+    """Fetches voices once per process; failures raise, so they are retried on the next call rather than cached."""
+    return CLIENT.voices()
+
+def fetch_voices_with_retry():
     global VOICE_CHOICES
-    for attempt in range(max_retries):
-        try:
-            print(f"Attempting to connect to API (Attempt {attempt + 1}/{max_retries})...")
-            response = requests.get(f"{API_BASE_URL}/voices", timeout=10)
-            response.raise_for_status()
-            VOICE_CHOICES = response.json()
-            print("Successfully connected to API and fetched voices.")
-            return VOICE_CHOICES
-        except requests.exceptions.RequestException as e:
-            print(f"API not ready yet ({e}). Waiting {delay_seconds} seconds...")
-            time.sleep(delay_seconds)
-    print("FATAL: Could not connect to API after multiple retries.")
-    return ["Error: API is not running or unreachable"]
+    try:
+        VOICE_CHOICES = fetch_voices_cached()
+        return VOICE_CHOICES
+    except (requests.exceptions.RequestException, ValueError):  # ValueError covers a malformed voices body
+        print("FATAL: Could not connect to API after multiple retries.")
+        return ["Error: API is not running or unreachable"]
 
 def call_api_and_play(script_payload: list, progress=gr.Progress()):
     if not script_payload:
-        return None, "Error: Script is empty."
-    payload = {"script": script_payload}
+        yield None, "Error: Script is empty."
+        return
     try:
-        start_time = time.time()
         progress(0, desc="Starting synthesis...")
-        response = requests.post(f"{API_BASE_URL}/synthesize-wav", json=payload, timeout=600)
-        progress(0.5, desc="Processing response...")
-        response.raise_for_status()
-        elapsed_time = time.time() - start_time
-        wav_bytes = response.content
-        wav_data_io = io.BytesIO(wav_bytes)
-        sample_rate, audio_data = read_wav(wav_data_io)
+        start_time = time.perf_counter()
+        yield gr.update(), "Sending request..."
+        # Chunks are fetched on a worker so the status keeps updating while the API is busy,
+        # and the next chunk downloads while Gradio delivers the current one
+        chunks = CLIENT.synthesize_stream(script_payload)
+        future = EXECUTOR.submit(next, chunks, None)
+        streaming = False
+        try:
+            while True:
+                try:
+                    chunk = future.result(timeout=STATUS_INTERVAL)
+                except FutureTimeoutError:
+                    state = "Streaming" if streaming else "Waiting for audio"
+                    yield gr.update(), f"{state}... ({time.perf_counter() - start_time:.2f} seconds elapsed)"
+                    continue
+                if chunk is None:
+                    break
+                future = EXECUTOR.submit(next, chunks, None)
+                if not streaming:
+                    streaming = True
+                    progress(0.5, desc="Streaming audio...")
+                yield chunk, f"Streaming... ({time.perf_counter() - start_time:.2f} seconds elapsed)"
+        finally:
+            # A stopped handler leaves the request open, so close it once the worker lets go of it
+            future.cancel()
+            future.add_done_callback(lambda _: chunks.close())
+        elapsed_time = time.perf_counter() - start_time
         progress(1.0, desc="Synthesis complete!")
-        return (sample_rate, audio_data), f"Success! Synthesis took {elapsed_time:.2f} seconds."
+        yield gr.update(), f"Success! Synthesis took {elapsed_time:.2f} seconds."
     except requests.exceptions.Timeout:
-        return None, "Error: API request timed out after 600 seconds. Try splitting the chapter into smaller scripts or using /synthesize-stream."
+        yield None, "Error: API request timed out after 600 seconds. Try splitting the chapter into smaller scripts."
+    except requests.exceptions.ChunkedEncodingError as e:
+        yield None, f"Error: Synthesis failed on the server partway through, so the audio is incomplete. Check the API logs. ({str(e)})"
     except requests.exceptions.RequestException as e:
         error_msg = f"API Error: {str(e)}"
-        try:
-            error_msg += f"\n\nServer Response:\n{response.json()}"
-        except:
-            pass
-        return None, error_msg
+        detail = error_detail(e)
+        if detail is not None:
+            error_msg += f"\n\nServer Response:\n{detail}"
+        yield None, error_msg
+    except ValueError as e:
+        yield None, f"Error: {str(e)}"
 
 def handle_simple_synthesis(text, voice, speed):
-    return call_api_and_play([{"text": text, "voice": voice, "speed": speed}])
+    yield from call_api_and_play([{"text": text, "voice": voice, "speed": speed}])
 
 def handle_dialogue_synthesis(json_data, progress=gr.Progress()):
     try:
-        script_data = json.loads(json_data)
+        script_data = orjson.loads(json_data)
         script = script_data.get("script", [])
-        if not isinstance(script, list):
-            return None, "Error: 'script' key must contain a list."
-        return call_api_and_play(script, progress)
-    except json.JSONDecodeError as e:
-        return None, f"Error: Invalid JSON format. {str(e)}"
+    except orjson.JSONDecodeError as e:
+        yield None, f"Error: Invalid JSON format. {str(e)}"
+        return
     except Exception as e:
-        return None, f"Error: Failed to process dialogue script. {str(e)}"
+        yield None, f"Error: Failed to process dialogue script. {str(e)}"
+        return
+    if not isinstance(script, list):
+        yield None, "Error: 'script' key must contain a list."
+        return
+    # One streamed request, so the API batches consecutive same-voice lines and plays the first line soonest
+    yield from call_api_and_play(script, progress)
 
 def handle_blend_synthesis(text, speed, enable1, voice1, weight1, enable2, voice2, weight2, enable3, voice3, weight3):
-    blend_components = []
-    if enable1 and weight1 > 0:
-        blend_components.append({"voice": voice1, "weight": weight1})
-    if enable2 and weight2 > 0:
-        blend_components.append({"voice": voice2, "weight": weight2})
-    if enable3 and weight3 > 0:
-        blend_components.append({"voice": voice3, "weight": weight3})
+    components = ((enable1, voice1, weight1), (enable2, voice2, weight2), (enable3, voice3, weight3))
+    blend_components = [{"voice": voice, "weight": weight} for enabled, voice, weight in components if enabled and weight > 0]
     if not blend_components:
-        return None, "No voices enabled for blending."
+        yield None, "No voices enabled for blending."
+        return
     script = [{"text": text, "blend_components": blend_components, "speed": speed}]
-    return call_api_and_play(script)
+    yield from call_api_and_play(script)
 
 def fetch_benchmark_results():
     try:
-        start_time = time.time()
-        response = requests.get(f"{API_BASE_URL}/benchmark", timeout=120)
-        response.raise_for_status()
-        elapsed_time = time.time() - start_time
-        data = response.json()
+        start_time = time.perf_counter()
+        data, from_cache = CLIENT.benchmark()
+        elapsed_time = time.perf_counter() - start_time
         results = data.get("results", [])
         system_info = data.get("system_info", {})
         recommendation = data.get("recommendation", {})
@@ -107,29 +131,44 @@ def fetch_benchmark_results():
         - Total RAM: {system_info.get('total_ram_gb', 'Unknown'):.2f} GB
         """
         
-        table = "| Model | Description | Size (MB) | Load Time (s) | Inference Time (s) | RTF | Memory Usage (MB) |\n"
-        table += "|-------|-------------|-----------|---------------|--------------------|-----|------------------|\n"
-        for res in sorted(results, key=lambda x: x["rtf"]):
-            table += f"| {res['model_name']} | {res['description']} | {res['size_mb']:.2f} | {res['load_time']:.4f} | {res['inference_time']:.4f} | {res['rtf']:.4f} | {res['mem_usage']:.2f} |\n"
+        rows = [
+            "| Model | Description | Size (MB) | Load Time (s) | Inference Time (s) | RTF | Memory Usage (MB) |",
+            "|-------|-------------|-----------|---------------|--------------------|-----|------------------|",
+        ]
+        rows.extend(
+            f"| {res['model_name']} | {res['description']} | {res['size_mb']:.2f} | {res['load_time']:.4f} | {res['inference_time']:.4f} | {res['rtf']:.4f} | {res['mem_usage']:.2f} |"
+            for res in sorted(results, key=itemgetter("rtf"))
+        )
+        table = "\n".join(rows)
         
+        best_balanced = recommendation.get("best_balanced") or {}
+        fastest = recommendation.get("fastest") or {}
+        highest_quality = recommendation.get("highest_quality") or {}
         rec_text = f"""
         **Recommendations**
-        - **Best Balanced**: {recommendation.get('best_balanced', {}).get('model_name', 'None')} ({recommendation.get('best_balanced', {}).get('description', 'None')})
-          - Reason: {recommendation.get('best_balanced', {}).get('reason', 'None')}
-        - **Fastest**: {recommendation.get('fastest', {}).get('model_name', 'None')} ({recommendation.get('fastest', {}).get('description', 'None')})
-          - Reason: {recommendation.get('fastest', {}).get('reason', 'None')}
+        - **Best Balanced**: {best_balanced.get('model_name', 'None')} ({best_balanced.get('description', 'None')})
+          - Reason: {best_balanced.get('reason', 'None')}
+        - **Fastest**: {fastest.get('model_name', 'None')} ({fastest.get('description', 'None')})
+          - Reason: {fastest.get('reason', 'None')}
         """
-        if recommendation.get('highest_quality', {}).get('model_name'):
+        if highest_quality.get('model_name'):
             rec_text += f"""
-        - **Highest Quality**: {recommendation['highest_quality']['model_name']} ({recommendation['highest_quality']['description']})
-          - Reason: {recommendation['highest_quality']['reason']}
+        - **Highest Quality**: {highest_quality['model_name']} ({highest_quality['description']})
+          - Reason: {highest_quality['reason']}
         """
         
-        optimal_model = recommendation.get("best_balanced", {}).get("model_name", "")
+        optimal_model = best_balanced.get("model_name", "")
         model_choices = [f"{r['model_name']} (optimal)" if r['model_name'] == optimal_model else r['model_name'] for r in results]
         default_model = f"{optimal_model} (optimal)" if optimal_model else None
         
-        return system_text + "\n\n" + table + "\n\n" + rec_text, model_choices, default_model, f"Benchmark completed successfully in {elapsed_time:.2f} seconds."
+        if from_cache:
+            status = f"Showing cached benchmark results (refreshed at most every {BENCHMARK_CACHE_TTL // 60} minutes)."
+        else:
+            status = f"Benchmark completed successfully in {elapsed_time:.2f} seconds."
+        downloading = data.get("downloading", [])
+        if downloading:
+            status += f" Still downloading {', '.join(downloading)}; run the benchmark again once they finish to include them."
+        return system_text + "\n\n" + table + "\n\n" + rec_text, model_choices, default_model, status
     except requests.exceptions.Timeout:
         error_msg = "Error: Benchmark request timed out after 120 seconds. Try using the INT8 model or increasing server resources."
         model_choices = FALLBACK_MODELS
@@ -151,21 +190,21 @@ def set_model(model_name):
         return "Error: No model selected."
     model_name = model_name.replace(" (optimal)", "")
     try:
-        response = requests.post(f"{API_BASE_URL}/set-model", json={"model_name": model_name}, timeout=10)
-        response.raise_for_status()
+        CLIENT.set_model(model_name)
         return f"Successfully switched to model: {model_name}"
     except requests.exceptions.RequestException as e:
         error_msg = f"Error: Failed to set model. {str(e)}"
-        try:
-            error_msg += f"\n\nServer Response:\n{response.json()}"
-        except:
-            pass
+        detail = error_detail(e)
+        if detail is not None:
+            error_msg += f"\n\nServer Response:\n{detail}"
         return error_msg
 
 def create_gradio_app():
-    voice_list = fetch_voices_with_retry()
-    example_script_dict = {"script": [{"text": "This is an editable script.", "voice": "am_eric", "speed": 0.9}, {"text": "Each line has its own timing and voice.", "voice": "af_sky", "delay": 0.5}]}
-    example_script_str = json.dumps(example_script_dict, indent=2)
+    # Fetch voices off the critical path so the UI renders while the API is still warming up
+    startup_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    voices_future = startup_pool.submit(fetch_voices_with_retry)
+    startup_pool.submit(CLIENT.prewarm)  # The voices fetch may be served from the disk cache without a socket
+    voice_list = VOICE_CHOICES or ["Loading..."]
 
     with gr.Blocks(theme=gr.themes.Soft(font=[gr.themes.GoogleFont("Roboto")])) as app:
         gr.Markdown("# 🎤 Kokoro TTS Service")
@@ -178,14 +217,14 @@ def create_gradio_app():
                         simple_speed = gr.Slider(label="Speed", minimum=0.5, maximum=2.0, step=0.1, value=1.0)
                         simple_btn = gr.Button("Synthesize")
                     with gr.Column(scale=2):
-                        simple_audio = gr.Audio(label="Output Audio", type="numpy")
+                        simple_audio = gr.Audio(label="Output Audio", type="numpy", streaming=True, autoplay=True)
                         simple_status = gr.Textbox(label="Status", interactive=False)
                 simple_btn.click(handle_simple_synthesis, [simple_text, simple_voice, simple_speed], [simple_audio, simple_status])
             
             with gr.TabItem("Dialogue & Scripting"):
-                dialogue_textbox = gr.Textbox(label="Dialogue Script (JSON)", value=example_script_str, lines=15)
+                dialogue_textbox = gr.Textbox(label="Dialogue Script (JSON)", value=EXAMPLE_SCRIPT_STR, lines=15)
                 dialogue_btn = gr.Button("Synthesize Dialogue")
-                dialogue_audio = gr.Audio(label="Output Audio", type="numpy")
+                dialogue_audio = gr.Audio(label="Output Audio", type="numpy", streaming=True, autoplay=True)
                 dialogue_status = gr.Textbox(label="Status", interactive=False)
                 dialogue_btn.click(handle_dialogue_synthesis, [dialogue_textbox], [dialogue_audio, dialogue_status])
             
@@ -197,21 +236,21 @@ def create_gradio_app():
                         with gr.Group():
                             gr.Markdown("#### Voice Component 1")
                             blend1_enable = gr.Checkbox(label="Enabled", value=True)
-                            blend1_voice = gr.Dropdown(label="Voice 1", choices=voice_list, value="am_adam")
+                            blend1_voice = gr.Dropdown(label="Voice 1", choices=VOICE_CHOICES or ["am_adam"], value="am_adam")
                             blend1_weight = gr.Slider(label="Weight 1", minimum=0.0, maximum=1.0, step=0.05, value=0.6)
                         with gr.Group():
                             gr.Markdown("#### Voice Component 2")
                             blend2_enable = gr.Checkbox(label="Enabled", value=True)
-                            blend2_voice = gr.Dropdown(label="Voice 2", choices=voice_list, value="af_nova")
+                            blend2_voice = gr.Dropdown(label="Voice 2", choices=VOICE_CHOICES or ["af_nova"], value="af_nova")
                             blend2_weight = gr.Slider(label="Weight 2", minimum=0.0, maximum=1.0, step=0.05, value=0.4)
                         with gr.Group():
                             gr.Markdown("#### Voice Component 3")
                             blend3_enable = gr.Checkbox(label="Enabled", value=False)
-                            blend3_voice = gr.Dropdown(label="Voice 3", choices=voice_list, value="am_onyx")
+                            blend3_voice = gr.Dropdown(label="Voice 3", choices=VOICE_CHOICES or ["am_onyx"], value="am_onyx")
                             blend3_weight = gr.Slider(label="Weight 3", minimum=0.0, maximum=1.0, step=0.05, value=0.0)
                         blend_btn = gr.Button("Synthesize Blended Voice")
                     with gr.Column(scale=2):
-                        blend_audio = gr.Audio(label="Output Audio", type="numpy")
+                        blend_audio = gr.Audio(label="Output Audio", type="numpy", streaming=True, autoplay=True)
                         blend_status = gr.Textbox(label="Status", interactive=False)
                 blend_inputs = [blend_text, blend_speed, blend1_enable, blend1_voice, blend1_weight, blend2_enable, blend2_voice, blend2_weight, blend3_enable, blend3_voice, blend3_weight]
                 blend_btn.click(handle_blend_synthesis, blend_inputs, [blend_audio, blend_status])
@@ -228,6 +267,13 @@ def create_gradio_app():
                 benchmark_btn.click(fetch_benchmark_results, [], [benchmark_output, model_select, model_select, benchmark_status])
                 set_model_btn.click(set_model, [model_select], [benchmark_status])
 
+        def refresh_voices():
+            voices_future.result()  # Only blocks if the startup fetch is still retrying
+            voices = fetch_voices_with_retry()
+            return gr.update(choices=voices, value=voices[0] if voices else None), *(gr.update(choices=voices) for _ in range(3))
+
+        app.load(refresh_voices, outputs=[simple_voice, blend1_voice, blend2_voice, blend3_voice])
+
     return app
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import requests
+import numpy as np
+import orjson
+import time
+import os
+import struct
+import hashlib
+import tempfile
+import socket
+from urllib.parse import urlsplit
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+WAV_HEADER_SIZE = 44
+STREAM_CHUNK_BYTES = 48000  # About one second of 24 kHz 16-bit audio per streamed chunk
+CACHE_DIR = Path(tempfile.gettempdir()) / "kokoro_gradio_cache"
+VOICES_CACHE_TTL = 300
+BENCHMARK_CACHE_TTL = 3600
+SYNTHESIS_TIMEOUT = (5, 600)  # Connect fast, but allow long chapters to finish
+
+def parse_wav_header(header: bytes) -> int:
+    """Returns the sample rate of a canonical 44-byte mono 16-bit PCM WAV header."""
+    riff, _, wave, _, _, audio_format, channels, sample_rate, _, _, bits, data, _ = struct.unpack("<4sI4s4sIHHIIHH4sI", header)
+    if riff != b"RIFF" or wave != b"WAVE" or data != b"data" or audio_format != 1 or channels != 1 or bits != 16:
+        raise ValueError("Unexpected WAV format from API.")
+    return sample_rate
+
+def error_detail(error: requests.exceptions.RequestException):
+    """Returns the JSON body the API sent with a failed request, or None when there is none to show."""
+    response = error.response
+    if response is None or not response.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        return orjson.loads(response.content)
+    except (orjson.JSONDecodeError, requests.exceptions.RequestException):
+        return None
+
+def raise_for_status_streamed(response: requests.Response):
+    """raise_for_status for streamed responses, reading the error body first so error_detail can still show it."""
+    if not response.ok:
+        response.content  # Loads the body before the caller's with-block closes the stream
+    response.raise_for_status()
+
+def read_cache_entry(path: Path):
+    """Returns the JSON stored at path, or None if it is missing or unreadable."""
+    try:
+        return orjson.loads(path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def write_cache_entry(path: Path, data: bytes):
+    """Writes through a temporary file, so readers and crashes never leave a partial entry behind."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class KokoroClient:
+    """Talks to the Kokoro TTS API over one pooled keep-alive session, so every caller shares warm connections."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers["Connection"] = "keep-alive"
+        # Only connection failures are retried: replaying a timed-out read would rerun a whole benchmark or synthesis,
+        # and read=False raises the read timeout as Timeout rather than wrapping it in ConnectionError
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=Retry(total=3, connect=3, read=False, status=0, other=0, backoff_factor=0.2))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def cached_get(self, path: str, ttl: float, timeout: float):
+        """GETs JSON through a disk cache; fresh entries skip the network, stale ones are revalidated by ETag.
+
+        Returns (data, from_cache). The cache is only an optimization: an unreadable entry is a miss,
+        and a cache directory that cannot be used falls back to plain network requests.
+        """
+        url = f"{self.base_url}{path}"
+        key = hashlib.md5(url.encode()).hexdigest()
+        body_path, etag_path = CACHE_DIR / f"{key}.json", CACHE_DIR / f"{key}.etag"
+        cached = read_cache_entry(body_path)
+        try:
+            if cached is not None and time.time() - body_path.stat().st_mtime < ttl:
+                return cached, True
+            etag = etag_path.read_text(encoding="utf-8") if cached is not None and etag_path.exists() else ""
+        except OSError:
+            cached, etag = None, ""
+        response = self.session.get(url, headers={"If-None-Match": etag} if etag else {}, timeout=timeout)
+        if response.status_code == 304:
+            try:
+                body_path.touch()
+            except OSError:
+                pass
+            return cached, True
+        response.raise_for_status()
+        data = response.json()
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return data, False
+        try:
+            CACHE_DIR.mkdir(exist_ok=True)
+            # Body before ETag: if only the body lands, the old ETag no longer matches and the next check refetches
+            write_cache_entry(body_path, response.content)
+            write_cache_entry(etag_path, response.headers.get("ETag", "").encode("utf-8"))
+        except OSError as e:
+            print(f"Could not write response cache ({e}).")
+        return data, False
+
+    def voices(self, max_retries=15, delay_seconds=0.5, max_delay_seconds=5):
+        """Returns the available voices, retrying with backoff while the API is still starting."""
+        for attempt in range(max_retries):
+            try:
+                print(f"Attempting to connect to API (Attempt {attempt + 1}/{max_retries})...")
+                voices, _ = self.cached_get("/voices", VOICES_CACHE_TTL, timeout=2)
+                print("Successfully connected to API and fetched voices.")
+                return voices
+            except requests.exceptions.RequestException as e:
+                if attempt + 1 == max_retries:
+                    raise
+                print(f"API not ready yet ({e}). Waiting {delay_seconds} seconds...")
+                time.sleep(delay_seconds)
+                delay_seconds = min(delay_seconds * 2, max_delay_seconds)
+
+    def benchmark(self, timeout=120):
+        """Returns (results, from_cache) for /benchmark."""
+        return self.cached_get("/benchmark", BENCHMARK_CACHE_TTL, timeout=timeout)
+
+    def set_model(self, model_name: str):
+        response = self.session.post(f"{self.base_url}/set-model", json={"model_name": model_name}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def prewarm(self):
+        """Resolves the API host and opens a pooled keep-alive connection, so the first request skips connection setup."""
+        url = urlsplit(self.base_url)
+        try:
+            socket.getaddrinfo(url.hostname, url.port or (443 if url.scheme == "https" else 80))
+            self.session.get(f"{self.base_url}/voices", timeout=2)
+        except (OSError, requests.exceptions.RequestException) as e:
+            print(f"Connection pre-warm skipped ({e}).")
+
+    def synthesize_stream(self, script: list):
+        """Yields (sample_rate, int16 samples) chunks of a streaming WAV as they arrive."""
+        with self.session.post(f"{self.base_url}/synthesize-wav", params={"stream": "true"}, json={"script": script}, stream=True, timeout=SYNTHESIS_TIMEOUT) as response:
+            raise_for_status_streamed(response)
+            sample_rate = None
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                buffer.extend(chunk)
+                if sample_rate is None:
+                    if len(buffer) < WAV_HEADER_SIZE:
+                        continue
+                    sample_rate = parse_wav_header(bytes(buffer[:WAV_HEADER_SIZE]))
+                    del buffer[:WAV_HEADER_SIZE]
+                # Keep a trailing partial sample in the buffer for the next chunk
+                usable = len(buffer) - len(buffer) % 2
+                if usable:
+                    # One copy out of the buffer; the temporary view is released before the buffer is trimmed.
+                    # Kept as int16: Gradio writes int16 straight to WAV, whereas float input is rescaled and converted back.
+                    audio_data = np.frombuffer(buffer, dtype=np.int16, count=usable // 2).copy()
+                    del buffer[:usable]
+                    yield sample_rate, audio_data
+            # iter_content raises ChunkedEncodingError on an aborted body; this catches one cut before the header
+            if sample_rate is None:
+                raise requests.exceptions.ChunkedEncodingError("Stream ended before the WAV header.", response=response)